@@ -1,12 +1,16 @@
-import os
-import time
-import json
-import hashlib
-import requests
-import jwt  # from PyJWT
 import pandas as pd
 import streamlit as st
 
+from passkit_client import (
+    PK_API_KEY,
+    PK_API_SECRET,
+    PK_API_PREFIX,
+    PROGRAM_ID,
+    RESULT_COLUMNS,
+    normalize_name,
+    search_by_display_names,
+)
+
 # ----------------------------
 # Page
 # ----------------------------
@@ -15,22 +19,8 @@ st.title("🔍 PassKit 重複 ID 搜尋工具")
 st.caption("每行貼一個 full name（PassKit: person.displayName），最多 150 行。用 REST Filter 查，不掃全量。")
 
 # ----------------------------
-# Config helpers
+# Config check
 # ----------------------------
-def get_config(key: str, default: str | None = None) -> str | None:
-    val = st.secrets.get(key) if hasattr(st, "secrets") else None
-    if val is None:
-        val = os.environ.get(key, default)
-    if val is None:
-        return None
-    # keep \n handling in case someone pastes multi-line values in secrets
-    return str(val).replace("\\n", "\n").strip()
-
-PK_API_KEY = get_config("PK_API_KEY")
-PK_API_SECRET = get_config("PK_API_SECRET")
-PK_API_PREFIX = get_config("PK_API_PREFIX", "https://api.pub1.passkit.io")
-PROGRAM_ID = get_config("PROGRAM_ID")
-
 missing_cfg = [k for k, v in {
     "PK_API_KEY": PK_API_KEY,
     "PK_API_SECRET": PK_API_SECRET,
@@ -42,120 +32,10 @@ if missing_cfg:
     st.error(f"❌ 缺少設定：{', '.join(missing_cfg)}（請在 .env 或 Secrets 補上）")
     st.stop()
 
-# ----------------------------
-# JWT auth (PassKit style)
-# - payload uses uid, iat, exp
-# - optional signature = SHA256(request body) for POST with body
-# - header Authorization = <jwt>  (NO 'Bearer ')
-# ----------------------------
-def make_jwt_for_body(body_text: str) -> str:
-    now = int(time.time())
-    payload = {
-        "uid": PK_API_KEY,
-        "iat": now,
-        "exp": now + 600,  # 10 minutes is typical for PassKit examples
-    }
-
-    if body_text:
-        payload["signature"] = hashlib.sha256(body_text.encode("utf-8")).hexdigest()
-
-    token = jwt.encode(payload, PK_API_SECRET, algorithm="HS256")
-    # PyJWT may return bytes in older versions; normalize
-    if isinstance(token, bytes):
-        token = token.decode("utf-8")
-    return token
-
-def post_list_members(filters_payload: dict) -> list[dict]:
-    """
-    Calls:
-      POST {PK_API_PREFIX}/members/member/list/{PROGRAM_ID}
-    Returns:
-      list of result objects (each line may be a JSON object)
-    """
-    url = f"{PK_API_PREFIX.rstrip('/')}/members/member/list/{PROGRAM_ID}"
-    body_text = json.dumps({"filters": filters_payload}, separators=(",", ":"), ensure_ascii=False)
-
-    token = make_jwt_for_body(body_text)
-    headers = {
-        "Authorization": token,  # PassKit examples: token directly, not Bearer
-        "Content-Type": "application/json",
-    }
-
-    resp = requests.post(url, headers=headers, data=body_text, timeout=30)
-
-    # Common failure hints
-    if resp.status_code == 404:
-        raise RuntimeError(
-            "404 Not Found：多半是 API Prefix 用錯（pub1/pub2），或 endpoint path 拼錯。"
-        )
-    if resp.status_code in (401, 403):
-        raise RuntimeError(
-            f"Auth 失敗（{resp.status_code}）：請確認 PK_API_KEY/PK_API_SECRET、以及 API Prefix（pub1/pub2）。"
-        )
-    if not resp.ok:
-        raise RuntimeError(f"HTTP {resp.status_code}: {resp.text[:500]}")
-
-    # PassKit list APIs sometimes return NDJSON (one JSON per line)
-    text = resp.text.strip()
-    if not text:
-        return []
-
-    items: list[dict] = []
-    # Try NDJSON first
-    lines = [ln for ln in text.split("\n") if ln.strip()]
-    for ln in lines:
-        try:
-            items.append(json.loads(ln))
-        except json.JSONDecodeError:
-            # maybe it's a single JSON
-            items = [json.loads(text)]
-            break
-
-    return items
-
-def extract_member_rows(list_response_items: list[dict], search_name: str, max_hits: int) -> list[dict]:
-    """
-    Each item is typically:
-      { "result": { ...member... } , ... }
-    We'll extract: person.displayName, id
-    """
-    rows = []
-    for item in list_response_items:
-        member = item.get("result") or item.get("member") or item
-        if not isinstance(member, dict):
-            continue
-
-        person = member.get("person") or {}
-        display_name = (person.get("displayName") or "").strip()
-        member_id = (member.get("id") or "").strip()
-
-        if display_name and member_id:
-            rows.append({
-                "搜尋姓名": search_name,
-                "displayName (person.displayName)": display_name,
-                "memberId (member.id)": member_id,
-            })
-
-        if len(rows) >= max_hits:
-            break
-    return rows
-
-def search_by_display_name(name: str, max_hits: int, operator: str) -> list[dict]:
-    # REST filter fields: displayName, operators: eq / like, etc. :contentReference[oaicite:2]{index=2}
-    filters = {
-        "limit": min(max_hits, 1000),
-        "offset": 0,
-        "filterGroups": [{
-            "condition": "AND",
-            "fieldFilters": [{
-                "filterField": "displayName",
-                "filterValue": name,
-                "filterOperator": operator,  # "eq" or "like"
-            }]
-        }]
-    }
-    items = post_list_members(filters)
-    return extract_member_rows(items, name, max_hits=max_hits)
+@st.cache_data(show_spinner=False)
+def rows_to_csv(rows: tuple[tuple, ...]) -> bytes:
+    df = pd.DataFrame.from_records(list(rows), columns=RESULT_COLUMNS)
+    return df.to_csv(index=False).encode("utf-8-sig")
 
 # ----------------------------
 # UI
@@ -178,7 +58,13 @@ with st.form("search_form"):
     submitted = st.form_submit_button("Search")
 
 if submitted:
-    names = [n.strip() for n in (input_text or "").splitlines() if n.strip()]
+    # Dedupe on the same normalized form matching uses ("Lee Chen" == "LEE  CHEN"),
+    # keeping the first spelling seen and paste order
+    unique_names: dict[str, str] = {}
+    for line in (input_text or "").splitlines():
+        if line.strip():
+            unique_names.setdefault(normalize_name(line), line.strip())
+    names = list(unique_names.values())
     if not names:
         st.warning("請先貼上至少一行姓名。")
         st.stop()
@@ -187,45 +73,38 @@ if submitted:
         st.warning(f"你貼了 {len(names)} 行，系統只會取前 150 行。")
         names = names[:50]
 
-    all_rows = []
-    missing = []
-
-    prog = st.progress(0)
-    status = st.empty()
-
-    for i, name in enumerate(names, start=1):
-        status.info(f"查詢中 {i}/{len(names)}：{name}")
+    with st.spinner(f"查詢中：{len(names)} 筆"):
         try:
-            rows = search_by_display_name(name, max_hits=int(max_hits), operator=operator)
-            if rows:
-                all_rows.extend(rows)
-            else:
-                missing.append(name)
+            all_rows = search_by_display_names(tuple(sorted(names)), max_hits=int(max_hits), operator=operator)
         except Exception as e:
-            st.error(f"❌ 查詢失敗：{name} → {e}")
-            missing.append(name)
+            st.error(f"❌ 查詢失敗：{e}")
+            st.stop()
 
-        prog.progress(i / len(names))
+    # Group each name's hits together in paste order (stable, so a name's rows
+    # keep their server order); response/cache order would interleave names.
+    order = {n: i for i, n in enumerate(names)}
+    all_rows = sorted(all_rows, key=lambda r: order[r[0]])
 
-    status.empty()
-    prog.empty()
+    found_inputs = {r[0] for r in all_rows}
+    missing = [n for n in names if n not in found_inputs]
 
     st.success(f"完成：查詢 {len(names)} 筆，命中 {len(all_rows)} 筆。")
 
     if all_rows:
-        # 轉成你要的三欄
-        df = pd.DataFrame(all_rows)
-        display_rows = []
-        for x in all_rows:
-            display_rows.append({
-                "搜尋姓名": x.get("搜尋姓名", ""),
-                "會員姓名": x.get("displayName (person.displayName)", x.get("會員姓名", "")),
-                "Passkit ID": x.get("memberId (member.id)", x.get("Passkit ID", "")),
-            })
-
-        st.dataframe(df, use_container_width=True)
-
-        csv = df.to_csv(index=False).encode("utf-8-sig")
+        # 轉成你要的三欄 — relabel client-side instead of rebuilding rows
+        df = pd.DataFrame.from_records(all_rows, columns=RESULT_COLUMNS)
+        st.dataframe(
+            df,
+            use_container_width=True,
+            hide_index=True,
+            column_config={
+                "搜尋姓名": st.column_config.TextColumn("搜尋姓名"),
+                "displayName (person.displayName)": st.column_config.TextColumn("會員姓名"),
+                "memberId (member.id)": st.column_config.TextColumn("Passkit ID", width="medium"),
+            },
+        )
+
+        csv = rows_to_csv(tuple(all_rows))
         st.download_button("下載 CSV", data=csv, file_name="passkit_member_ids.csv", mime="text/csv")
 
     if missing:
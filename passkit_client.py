@@ -0,0 +1,376 @@
+"""PassKit REST client shared by the Streamlit UI: config, session, JWT auth and member search."""
+import os
+import time
+import base64
+import contextlib
+import functools
+import hashlib
+import hmac
+import threading
+from collections.abc import Iterable, Iterator
+import ahocorasick  # from pyahocorasick
+import orjson
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import streamlit as st
+
+# ----------------------------
+# Config helpers
+# ----------------------------
+# Secrets/env don't change within a process, so resolve each key once.
+# This module is imported once per process (unlike the rerun app script),
+# so a plain lru_cache survives reruns without Streamlit's cache hashing.
+@functools.lru_cache(maxsize=32)
+def get_config(key: str, default: str | None = None) -> str | None:
+    try:
+        val = st.secrets.get(key) if hasattr(st, "secrets") else None
+    except Exception:
+        # st.secrets raises when no secrets.toml exists; fall back to env
+        val = None
+    if val is None:
+        val = os.environ.get(key, default)
+    if val is None:
+        return None
+    # keep \n handling in case someone pastes multi-line values in secrets
+    return str(val).replace("\\n", "\n").strip()
+
+PK_API_KEY = get_config("PK_API_KEY")
+PK_API_SECRET = get_config("PK_API_SECRET")
+PK_API_PREFIX = get_config("PK_API_PREFIX", "https://api.pub1.passkit.io")
+PROGRAM_ID = get_config("PROGRAM_ID")
+# Set to 0 to skip the optional body-SHA256 claim; one token then covers every request
+PK_INCLUDE_BODY_SIG = get_config("PK_INCLUDE_BODY_SIG", "1") == "1"
+
+# ----------------------------
+# HTTP session
+# - one pooled keep-alive session per process (survives reruns)
+# - transient 429/5xx are retried with backoff
+# - the API host is pre-connected at import
+# ----------------------------
+@st.cache_resource
+def get_session() -> requests.Session:
+    session = requests.Session()
+    session.headers.update({"Content-Type": "application/json"})
+    retry = Retry(
+        total=3,
+        backoff_factor=0.3,
+        status_forcelist=[429, 502, 503, 504],
+        allowed_methods=["GET", "HEAD", "POST"],  # member list POST is read-only
+        raise_on_status=False,  # let post_list_members report the final status
+    )
+    session.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=50, max_retries=retry))
+    return session
+
+def warm_connection(session: requests.Session, url: str) -> None:
+    # Any response will do: the point is the DNS lookup + TLS handshake,
+    # which leaves a keep-alive connection in the pool for the first search.
+    try:
+        session.head(url, timeout=5)
+    except requests.RequestException:
+        pass
+
+# Runs once per process at import; a background thread so startup isn't blocked.
+# get_session() is resolved here, on the script thread, not inside the worker.
+if PK_API_PREFIX:
+    threading.Thread(target=warm_connection, args=(get_session(), PK_API_PREFIX), daemon=True).start()
+
+# ----------------------------
+# JWT auth (PassKit style)
+# - payload uses uid, iat, exp
+# - optional signature = SHA256(request body) for POST with body
+#   (toggle with PK_INCLUDE_BODY_SIG)
+# - header Authorization = <jwt>  (NO 'Bearer ')
+# - HS256 is signed directly with hmac; the header never changes
+# ----------------------------
+JWT_TTL_SECONDS = 600  # 10 minutes is typical for PassKit examples
+JWT_REFRESH_MARGIN = 60  # re-sign this long before exp so a cached token never lapses mid-request
+JWT_HEADER_B64 = b"eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9"  # base64url({"alg":"HS256","typ":"JWT"})
+
+def b64url(data: bytes) -> bytes:
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+@st.cache_data(ttl=JWT_TTL_SECONDS - JWT_REFRESH_MARGIN, max_entries=16, show_spinner=False)
+def sign_jwt(api_key: str, api_secret: str, body_signature: str) -> str:
+    # Cached until shortly before `exp`. Reuse mostly happens with
+    # PK_INCLUDE_BODY_SIG=0 (one token for every body); per-body tokens are
+    # rarely hit again, so keep only a few.
+    now = int(time.time())
+    payload = {
+        "uid": api_key,
+        "iat": now,
+        "exp": now + JWT_TTL_SECONDS,
+    }
+
+    if body_signature:
+        payload["signature"] = body_signature
+
+    signing_input = JWT_HEADER_B64 + b"." + b64url(orjson.dumps(payload))
+    sig = hmac.new(api_secret.encode("utf-8"), signing_input, hashlib.sha256).digest()
+    return (signing_input + b"." + b64url(sig)).decode("ascii")
+
+def make_jwt_for_body(body: bytes) -> str:
+    body_signature = hashlib.sha256(body).hexdigest() if body and PK_INCLUDE_BODY_SIG else ""
+    return sign_jwt(PK_API_KEY, PK_API_SECRET, body_signature)
+
+DRAIN_MAX_BYTES = 256 * 1024  # on early stop, read off at most this much to keep the connection
+
+def post_list_members(filters_payload: dict) -> Iterator[dict]:
+    """
+    Calls:
+      POST {PK_API_PREFIX}/members/member/list/{PROGRAM_ID}
+    Yields:
+      result objects as the body streams in (each line may be a JSON object);
+      if the caller stops early (close()), a small unread tail is drained so
+      the connection goes back to the pool
+    """
+    url = f"{PK_API_PREFIX.rstrip('/')}/members/member/list/{PROGRAM_ID}"
+    # orjson emits compact UTF-8 bytes directly: same bytes are signed and sent
+    body = orjson.dumps({"filters": filters_payload})
+
+    token = make_jwt_for_body(body)
+    headers = {
+        "Authorization": token,  # PassKit examples: token directly, not Bearer
+    }
+
+    with get_session().post(url, headers=headers, data=body, timeout=30, stream=True) as resp:
+        # Common failure hints
+        if resp.status_code == 404:
+            raise RuntimeError(
+                "404 Not Found：多半是 API Prefix 用錯（pub1/pub2），或 endpoint path 拼錯。"
+            )
+        if resp.status_code in (401, 403):
+            raise RuntimeError(
+                f"Auth 失敗（{resp.status_code}）：請確認 PK_API_KEY/PK_API_SECRET、以及 API Prefix（pub1/pub2）。"
+            )
+        if not resp.ok:
+            raise RuntimeError(f"HTTP {resp.status_code}: {resp.text[:500]}")
+
+        try:
+            # PassKit list APIs sometimes return NDJSON (one JSON per line);
+            # parse it as it streams instead of buffering the whole body.
+            lines = (ln for ln in resp.iter_lines() if ln.strip())
+            first = next(lines, None)
+            if first is None:
+                return
+
+            try:
+                head = orjson.loads(first)
+            except orjson.JSONDecodeError:
+                # maybe it's a single (pretty-printed) JSON
+                doc = orjson.loads(b"\n".join([first, *lines]))
+                yield from doc if isinstance(doc, list) else [doc]
+                return
+
+            if isinstance(head, list):
+                yield from head
+                return
+
+            yield head
+            for ln in lines:
+                yield orjson.loads(ln)
+        except GeneratorExit:
+            # The caller stopped early (every name already full). If a small tail
+            # is still unread, read it off unparsed so close() can hand the
+            # keep-alive connection back to the pool; a larger tail is cheaper to
+            # drop with the socket than to download. Best-effort only: the rows
+            # are already collected, so a failed drain must not fail the search.
+            if not resp._content_consumed:
+                try:
+                    drained = 0
+                    for chunk in resp.iter_content(chunk_size=64 * 1024):
+                        drained += len(chunk)
+                        if drained > DRAIN_MAX_BYTES:
+                            break
+                except requests.RequestException:
+                    pass
+            raise
+
+RESULT_COLUMNS = ["搜尋姓名", "displayName (person.displayName)", "memberId (member.id)"]
+
+def normalize_name(s: str) -> str:
+    # str.split() collapses any whitespace run and trims, without a regex pass
+    return " ".join(s.upper().split())
+
+def extract_member_rows(
+    list_response_items: Iterable[dict],
+    names: list[str],
+    max_hits: int,
+    operator: str,
+    hit_counts: dict[str, int],
+    seen: set[tuple[str, str]],
+) -> tuple[list[tuple], int]:
+    """
+    Each item is typically:
+      { "result": { ...member... } , ... }
+    We'll extract: person.displayName, id
+    and assign each member back to the input name(s) it matches
+    (eq = same normalized name, like = input contained in displayName).
+    hit_counts / seen carry over between pages, so a member already credited
+    to a name isn't counted twice.
+    Returns (rows, item_count): rows are (search_name, displayName, memberId)
+    tuples in RESULT_COLUMNS order; item_count is how many items were read.
+    """
+    names_by_norm: dict[str, list[str]] = {}
+    for name in names:
+        names_by_norm.setdefault(normalize_name(name), []).append(name)
+    unfilled = sum(1 for n in names if hit_counts[n] < max_hits)  # inputs still below max_hits
+    if not unfilled:
+        return [], 0
+
+    # like: one Aho-Corasick pass per displayName finds every input it contains
+    automaton = None
+    if operator != "eq":
+        automaton = ahocorasick.Automaton()
+        for key in names_by_norm:
+            automaton.add_word(key, key)
+        automaton.make_automaton()
+
+    # Lines of one response share an envelope: remember the key that carried
+    # a payload and read it directly, probing again only when it comes up empty.
+    wrap_key = None
+
+    rows = []
+    item_count = 0
+    for item in list_response_items:
+        item_count += 1
+        member = item.get(wrap_key) if wrap_key else None
+        if not member:
+            for key in ("result", "member"):
+                if item.get(key):
+                    wrap_key, member = key, item[key]
+                    break
+            else:
+                member = item
+        if not isinstance(member, dict):
+            continue
+
+        person = member.get("person") or {}
+        display_name = (person.get("displayName") or "").strip()
+        member_id = (member.get("id") or "").strip()
+        if not (display_name and member_id):
+            continue
+
+        norm = normalize_name(display_name)
+        if operator == "eq":
+            matched = names_by_norm.get(norm, [])
+        else:
+            contained = dict.fromkeys(key for _, key in automaton.iter(norm))
+            matched = [n for key in contained for n in names_by_norm[key]]
+
+        for search_name in matched:
+            if hit_counts[search_name] >= max_hits or (search_name, member_id) in seen:
+                continue
+            seen.add((search_name, member_id))
+            hit_counts[search_name] += 1
+            rows.append((search_name, display_name, member_id))
+            if hit_counts[search_name] == max_hits:
+                unfilled -= 1
+
+        if not unfilled:
+            # every input is full; later members can't add rows
+            break
+    return rows, item_count
+
+# ----------------------------
+# Per-name hit cache
+# - names found recently are answered locally, so a refined list only
+#   queries the names that are new (misses are always re-queried)
+# - only complete answers are stored: the name reached max_hits, or its
+#   last page came back short; a partial count may just be a cut-off page
+# ----------------------------
+MEMBER_CACHE_TTL = 300
+MEMBER_CACHE_MAXSIZE = 4096
+_member_cache: dict[tuple[str, int, str], tuple[float, list[tuple]]] = {}
+_member_cache_lock = threading.Lock()  # shared by every session's script thread
+
+def cached_member_rows(name: str, max_hits: int, operator: str) -> list[tuple] | None:
+    with _member_cache_lock:
+        entry = _member_cache.get((name, max_hits, operator))
+    if entry is None or entry[0] < time.time():
+        return None
+    return entry[1]
+
+def remember_member_rows(rows: list[tuple], complete: set[str], max_hits: int, operator: str) -> None:
+    expires = time.time() + MEMBER_CACHE_TTL
+    rows_by_name: dict[str, list[tuple]] = {}
+    for row in rows:
+        if row[0] in complete:
+            rows_by_name.setdefault(row[0], []).append(row)
+
+    with _member_cache_lock:
+        for name, name_rows in rows_by_name.items():
+            key = (name, max_hits, operator)
+            _member_cache.pop(key, None)  # re-insert at the end: oldest stay first
+            _member_cache[key] = (expires, name_rows)
+        while len(_member_cache) > MEMBER_CACHE_MAXSIZE:
+            del _member_cache[next(iter(_member_cache))]
+
+MAX_LIST_PAGES = 50  # guard against a server that ignores offset
+
+# Re-running the same list (re-clicking Search, or pasting it in another order)
+# reuses the last result for 5 minutes instead of hitting PassKit again.
+# Errors are not cached.
+@st.cache_data(ttl=300, show_spinner=False)
+def search_by_display_names(names: tuple[str, ...], max_hits: int, operator: str) -> list[tuple]:
+    rows: list[tuple] = []
+    misses: list[str] = []
+    for name in names:
+        hit = cached_member_rows(name, max_hits, operator)
+        if hit is None:
+            misses.append(name)
+        else:
+            rows.extend(hit)
+    if not misses:
+        return rows
+
+    # One OR'd filter group for all names -> usually a single round-trip instead
+    # of one per name. The names share one page, so a name with many duplicates
+    # can crowd the others out: while a page comes back full and some name is
+    # still under max_hits, keep going. Re-query just the unfilled names when
+    # that set shrank (restarting at offset 0), otherwise page on.
+    hit_counts = dict.fromkeys(misses, 0)
+    seen: set[tuple[str, str]] = set()
+    fresh: list[tuple] = []
+    complete: set[str] = set()  # names whose rows are known to be all there is (up to max_hits)
+    pending = misses
+    offset = 0
+    for _ in range(MAX_LIST_PAGES):
+        limit = min(max_hits * len(pending), 1000)
+        # REST filter fields: displayName, operators: eq / like, etc. :contentReference[oaicite:2]{index=2}
+        filters = {
+            "limit": limit,
+            "offset": offset,
+            "filterGroups": [{
+                "condition": "OR",
+                "fieldFilters": [{
+                    "filterField": "displayName",
+                    "filterValue": name,
+                    "filterOperator": operator,  # "eq" or "like"
+                } for name in pending]
+            }]
+        }
+        # closing() finishes the streamed response (draining it) when extraction stops early
+        with contextlib.closing(post_list_members(filters)) as items:
+            page_rows, item_count = extract_member_rows(items, pending, max_hits, operator, hit_counts, seen)
+        fresh.extend(page_rows)
+
+        if item_count < limit:
+            # short page: the server has nothing more for any pending name
+            complete.update(pending)
+            break
+        unfilled = [n for n in pending if hit_counts[n] < max_hits]
+        complete.update(n for n in pending if hit_counts[n] >= max_hits)
+        if not unfilled:
+            break
+        if len(unfilled) < len(pending):
+            pending, offset = unfilled, 0
+        else:
+            offset += limit
+    else:
+        raise RuntimeError(
+            f"結果超過 {MAX_LIST_PAGES} 頁仍未取完：請縮小名單、降低同名筆數，或改用 eq。"
+        )
+
+    remember_member_rows(fresh, complete, max_hits, operator)
+    return rows + fresh
@@ -0,0 +1,77 @@
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import orjson
+import pytest
+
+os.environ.setdefault("PK_API_KEY", "test-key")
+os.environ.setdefault("PK_API_SECRET", "test-secret")
+os.environ.setdefault("PROGRAM_ID", "test-program")
+# Nothing listens here, so the import-time connection warm-up fails fast.
+os.environ["PK_API_PREFIX"] = "http://127.0.0.1:9"
+
+import passkit_client  # noqa: E402
+
+
+def member(i: int, name: str = "LEE CHEN") -> dict:
+    return {"result": {"id": f"m{i}", "person": {"displayName": name}}}
+
+
+MEMBERS = [member(i) for i in range(5)]
+
+BODIES = {
+    "ndjson": b"\n".join(orjson.dumps(m) for m in MEMBERS) + b"\n",
+    # the last line is what fills the name, so the stream is already at EOF
+    "ndjson-no-trailing-newline": b"\n".join(orjson.dumps(m) for m in MEMBERS[:3]),
+    "array": orjson.dumps(MEMBERS),
+    "pretty-array": orjson.dumps(MEMBERS, option=orjson.OPT_INDENT_2),
+    # far more unread tail than DRAIN_MAX_BYTES after the early stop
+    "ndjson-large-tail": b"\n".join(orjson.dumps(member(i)) for i in range(20000)),
+}
+
+
+@pytest.fixture
+def server(monkeypatch):
+    state = {"body": b"", "connections": set()}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            state["connections"].add(self.client_address)
+            self.rfile.read(int(self.headers["Content-Length"]))
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(state["body"])))
+            self.end_headers()
+            self.wfile.write(state["body"])
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    monkeypatch.setattr(passkit_client, "PK_API_PREFIX", f"http://127.0.0.1:{httpd.server_port}")
+    passkit_client.search_by_display_names.clear()
+    passkit_client._member_cache.clear()
+    yield state
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.mark.parametrize("body", BODIES.values(), ids=BODIES.keys())
+def test_early_stop_returns_collected_rows(server, body):
+    server["body"] = body
+
+    rows = passkit_client.search_by_display_names(("LEE CHEN",), 3, "eq")
+
+    assert rows == [("LEE CHEN", "LEE CHEN", f"m{i}") for i in range(3)]
+
+
+def test_early_stop_with_small_tail_reuses_connection(server):
+    server["body"] = BODIES["ndjson"]
+
+    for max_hits in (1, 2):
+        passkit_client.search_by_display_names(("LEE CHEN",), max_hits, "eq")
+
+    assert len(server["connections"]) == 1